@@ -1,18 +1,25 @@
+import functools
 import logging
+import os
 import time
 import random
 from datetime import datetime, date, timedelta
 
 import click
-import pandas as pd
 
 
-from sfrent import models, db
-from sfrent.scrape import scrape_craigslist
+from sfrent import models, db, utils, jobs
 
 
 logger = logging.getLogger(__name__)
 
+# Modules timed by `startup_report`, roughly in the order the app loads them.
+STARTUP_MODULES = (
+    'pytz', 'sqlalchemy', 'flask', 'flask_sqlalchemy', 'flask_bootstrap',
+    'numpy', 'pandas', 'craigslist', 'sfrent', 'sfrent.models',
+    'sfrent.views', 'manage',
+)
+
 
 @click.group()
 @click.option('--verbose', is_flag=True, help="Increase logging output")
@@ -55,15 +62,7 @@ def scrape(hidescrape):
         logger.info(f"Sleeping for {sleep} seconds before scraping.")
         time.sleep(sleep)
 
-    try:
-        listings = scrape_craigslist()
-    except Exception:
-        listings_added = None
-        models.ScrapeLog.add_stamp(listings_added, is_success=False)
-        raise
-    else:
-        listings_added = models.ApartmentListing.bulk_insert(listings)
-        models.ScrapeLog.add_stamp(listings_added)    
+    jobs.scrape()
 
 
 @cli.command()
@@ -73,8 +72,7 @@ def update_neighborhoods(threshold):
     """Inserts any new neighborhoods discovered and sets neighborhoods to
     active if they exceed the minimum 100 listing threshold in the past 
     28 days."""
-    models.Neighborhoods.create_hoods()
-    models.Neighborhoods.set_active(threshold)
+    jobs.update_neighborhoods(threshold)
 
 
 @cli.command()
@@ -83,9 +81,145 @@ def update_neighborhoods(threshold):
 def run_bootstraps(date, trials):
     if date is not None:
         date = datetime.strptime(date, '%Y-%m-%d').date()
-    else:
-        date = datetime.now().date() - timedelta(1)
-    models.ListingPriceStatistics.run_bootstrap(date, trials=trials)
+    jobs.run_bootstraps(date, trials=trials)
+
+
+@cli.command()
+@click.argument('start_date')
+@click.argument('end_date')
+def rebuild_sketches(start_date, end_date):
+    """Recreates the price sketches between two dates from the raw
+    listings, e.g. to backfill them for listings scraped before they
+    existed."""
+    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    models.ListingPriceSketch.rebuild(start_date, end_date)
+
+
+@cli.command()
+@click.option('--days', '-d', type=int,
+              help="Archive listings older than this, defaults to LISTING_RETENTION_DAYS")
+def compact_listings(days):
+    """Rolls up old listings into daily aggregates and moves the raw rows
+    into the archive table."""
+    jobs.compact_listings(days)
+
+
+@cli.command()
+@click.argument('start_date')
+@click.argument('end_date')
+def restore_listings(start_date, end_date):
+    """Moves archived listings posted between two dates back into the
+    listings table, e.g. before running backfill_bootstraps."""
+    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    models.ArchivedApartmentListing.restore(start_date, end_date)
+
+
+@cli.command()
+@click.option('--output', '-o', help="Directory to write to, defaults to STATIC_SNAPSHOT_DIR")
+@click.option('--force', '-f', is_flag=True, help="Re-render pages even if their data is unchanged")
+def render_static(output, force):
+    """Renders the home page and all active neighborhood pages to static
+    html, in the database if SNAPSHOTS_IN_DATABASE is set and no --output
+    is given, otherwise to a directory."""
+    from flask import current_app
+    from sfrent.snapshots import render_snapshots
+
+    app = current_app._get_current_object()
+    if not output and not app.config['SNAPSHOTS_IN_DATABASE']:
+        output = app.config['STATIC_SNAPSHOT_DIR']
+        if not output:
+            raise click.UsageError(
+                "Pass --output or set SNAPSHOTS_IN_DATABASE or STATIC_SNAPSHOT_DIR")
+    rendered, skipped, removed = render_snapshots(app, output, force=force)
+    logger.info(f"Rendered {rendered} pages, {skipped} unchanged, {removed} removed.")
+
+
+@cli.command()
+@click.option('--hidescrape', is_flag=True,
+              help="Skip most scrapes and jitter the rest by up to 10 minutes")
+@click.option('--trials', '-t', type=int, default=1000)
+@click.option('--threshold', default=100, type=int)
+def scheduler(hidescrape, trials, threshold):
+    """Runs the scrape, bootstrap and neighborhood jobs on a schedule in one
+    long-running process instead of as one-off dynos. Times are UTC."""
+    from flask import current_app
+    from sfrent.scheduler import Scheduler, SKIP
+    from sfrent.snapshots import render_snapshots
+
+    def scrape_job():
+        # same odds as `scrape --hidescrape`, the scheduler adds the jitter
+        if hidescrape and random.random() < 0.7:
+            logger.info("Choosing not to scrape")
+            return SKIP
+        jobs.scrape()
+
+    app = current_app._get_current_object()
+    sched = Scheduler(app)
+    sched.add_job('scrape', scrape_job, '0 * * * *',
+                  jitter=600 if hidescrape else 0, retries=2, backoff=60)
+    sched.add_job('run_bootstraps',
+                  functools.partial(jobs.run_bootstraps, trials=trials),
+                  '0 9 * * *', retries=2, backoff=300)
+    sched.add_job('update_neighborhoods',
+                  functools.partial(jobs.update_neighborhoods, threshold),
+                  '0 11 * * *', retries=2, backoff=300)
+    sched.add_job('compact_listings', jobs.compact_listings,
+                  '0 12 * * *', retries=2, backoff=300)
+    if app.config['SNAPSHOTS_IN_DATABASE']:
+        # after the hourly scrape (jittered by up to 10 minutes) lands. Only
+        # the database store, the worker dyno's filesystem isn't visible to
+        # the web dynos.
+        sched.add_job('render_static',
+                      functools.partial(render_snapshots, app),
+                      '20 * * * *', retries=1, backoff=60)
+    sched.run()
+
+
+@cli.command()
+@click.option('--listings', '-l', default=20000, type=int, help="Synthetic listings to seed")
+@click.option('--neighborhoods', default=20, type=int, help="Active neighborhoods to seed")
+@click.option('--days', '-d', default=180, type=int, help="Days of history to seed")
+@click.option('--workers', '-w', default='1,2,4', help="Comma separated gunicorn worker counts to test")
+@click.option('--requests', '-n', default=600, type=int, help="Requests per worker count")
+@click.option('--concurrency', '-c', default=8, type=int, help="Requests in flight at once")
+@click.option('--noseed', is_flag=True, help="Reuse the previously seeded database")
+@click.option('--yes', '-y', is_flag=True, help="Don't ask before dropping the database's tables")
+def loadtest(listings, neighborhoods, days, workers, requests, concurrency, noseed, yes):
+    """Seeds a local database with synthetic data, runs the app under
+    gunicorn against it and reports latency and throughput of successful
+    requests, and errors, per route for each worker count. The database is
+    LOADTEST_DATABASE_URL, by default loadtest.db next to this file."""
+    from config import config
+    from sfrent import create_app, loadtest as harness
+
+    app = create_app('loadtest')
+    database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    other_uris = {c.SQLALCHEMY_DATABASE_URI for name, c in config.items()
+                  if name != 'loadtest'}
+    if database_uri in other_uris | {os.environ.get('DATABASE_URL')}:
+        raise click.UsageError(
+            f"Refusing to seed over {database_uri}, it's used by another config")
+    if not noseed and not yes:
+        click.confirm(f"This drops every table in {database_uri}. Continue?",
+                      abort=True)
+
+    with app.app_context():
+        if not noseed:
+            harness.seed(listings, neighborhoods, days)
+        results = harness.run(database_uri,
+                              [int(w) for w in workers.split(',')],
+                              requests=requests, concurrency=concurrency)
+
+    click.echo(f"{'workers':>7}  {'route':<20}{'requests':>9}{'errors':>7}"
+               f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}")
+    for num_workers, routes in results.items():
+        for route, stats in routes.items():
+            latencies = ''.join(f"{stats[p]:>9.1f}" if stats[p] is not None
+                                else f"{'-':>9}" for p in ('p50', 'p95', 'p99'))
+            click.echo(f"{num_workers:>7}  {route:<20}{stats['requests']:>9}"
+                       f"{stats['errors']:>7}{latencies}{stats['rps']:>8.1f}")
 
 
 @cli.command()
@@ -93,9 +227,34 @@ def run_bootstraps(date, trials):
 @click.argument('end_date')
 @click.option('--trials', '-t', type=int, default=1000)
 def backfill_bootstraps(start_date, end_date, trials):
-    for dt in pd.date_range(start_date, end_date):
+    dt = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    while dt <= end_date:
         click.echo(dt)
-        models.ListingPriceStatistics.run_bootstrap(dt.date(), trials=trials)
+        models.ListingPriceStatistics.run_bootstrap(dt, trials=trials)
+        dt += timedelta(1)
+
+
+@cli.command()
+@click.option('--repeat', '-r', default=3, type=int,
+              help="Number of cold imports to time per module, best is kept")
+@click.argument('modules', nargs=-1)
+def startup_report(repeat, modules):
+    """Reports how long each module takes to import in a fresh Python
+    process. `manage` is the full cost of booting a web worker."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for module in modules or STARTUP_MODULES:
+        try:
+            seconds = min(utils.measure_import(module, cwd=cwd)
+                          for _ in range(repeat))
+        except Exception:
+            logger.warning("Could not import %s", module)
+            continue
+        timings.append((seconds, module))
+
+    for seconds, module in sorted(timings, reverse=True):
+        click.echo(f"{seconds * 1000:10.1f} ms  {module}")
 
 
 
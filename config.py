@@ -11,6 +11,15 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'listings.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = True
 
+    # serve pages pre-rendered by `cli.py render_static`, either from the
+    # database (works across Heroku dynos) or from a directory on this host
+    SNAPSHOTS_IN_DATABASE = bool(os.environ.get('SNAPSHOTS_IN_DATABASE'))
+    STATIC_SNAPSHOT_DIR = os.environ.get('STATIC_SNAPSHOT_DIR')
+    STATIC_SNAPSHOT_MAX_AGE = 300
+
+    # raw listings older than this are rolled up and archived
+    LISTING_RETENTION_DAYS = 90
+
 
     @classmethod
     def init_app(cls, app):
@@ -21,9 +30,22 @@ class Config:
 class HerokuConfig(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    # the scheduler worker holds connections for hours, recycle them before
+    # the server drops them as idle
+    SQLALCHEMY_POOL_RECYCLE = 300
+
+
+class LoadTestConfig(Config):
+    """Used by `cli.py loadtest` for the seeded database and the gunicorn
+    it starts against it."""
+    DEBUG = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'LOADTEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'loadtest.db'))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 
 config = dict(
     development=Config(),
-    heroku=HerokuConfig()
+    heroku=HerokuConfig(),
+    loadtest=LoadTestConfig()
 )
\ No newline at end of file
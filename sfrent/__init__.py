@@ -16,7 +16,7 @@ def create_app(config_name):
     db.init_app(app)
     Bootstrap(app)
 
-    from . import models, filters, views
+    from . import models, filters, views, snapshots
 
     @app.context_processor
     def setup_navbar_and_footer():
@@ -28,12 +28,24 @@ def create_app(config_name):
     app.add_url_rule('/', view_func=views.ShowHome.as_view('home'))
     app.add_url_rule('/hoods/<int:neighborhood_id>/<slug>', 
                      view_func=views.ShowNeighborhood.as_view('hood'))
+    app.add_url_rule('/api/tseries',
+                     view_func=views.ShowPriceSeries.as_view('tseries'))
+    app.add_url_rule('/api/hoods/<int:neighborhood_id>/tseries',
+                     view_func=views.ShowPriceSeries.as_view('hood_tseries'))
+    app.add_url_rule('/api/quantiles',
+                     view_func=views.ShowPriceQuantiles.as_view('quantiles'))
+    app.add_url_rule('/api/hoods/<int:neighborhood_id>/quantiles',
+                     view_func=views.ShowPriceQuantiles.as_view('hood_quantiles'))
     app.add_url_rule('/scrape/logs',
                      view_func=views.ShowScrapes.as_view('show_scrapes'))
 
+    if app.config['SNAPSHOTS_IN_DATABASE'] or app.config['STATIC_SNAPSHOT_DIR']:
+        app.before_request(snapshots.serve_snapshot)
+
     app.jinja_env.filters['price'] = lambda x: '${:7,.0f}'.format(x)
     app.jinja_env.filters['price_per_sqft'] = lambda x: '${:5.2f}'.format(x)
     app.jinja_env.filters['timesince'] = filters.timesince
+    app.jinja_env.filters['isoformat'] = filters.isoformat
     app.jinja_env.filters['format_pst'] = filters.format_pst
     app.jinja_env.filters['format_date'] = filters.format_date
 
@@ -2,6 +2,8 @@ from datetime import date, datetime
 
 import pytz
 
+from .utils import as_utc
+
 
 def timesince(dt, default="just now"):
     """
@@ -12,6 +14,7 @@ def timesince(dt, default="just now"):
     """
     if not isinstance(dt, (datetime, date)):
         return dt
+    dt = as_utc(dt)
     now = datetime.utcnow().replace(tzinfo=pytz.utc)
     diff = now - dt
 
@@ -31,13 +34,21 @@ def timesince(dt, default="just now"):
     return default
 
 
+def isoformat(dt):
+    """ISO 8601 timestamp for `<time datetime="...">`, so the browser can
+    work out relative times itself."""
+    if not isinstance(dt, datetime):
+        return ''
+    return as_utc(dt).isoformat()
+
+
 def format_pst(datetime):
     pst = pytz.timezone('US/Pacific')
-    datetime_pst = datetime.astimezone(pst)
+    datetime_pst = as_utc(datetime).astimezone(pst)
     return datetime_pst.strftime('%H:%M PST')
 
 
 def format_date(datetime):
     pst = pytz.timezone('US/Pacific')
-    datetime_pst = datetime.astimezone(pst)
-    return datetime_pst.strftime('%b %d')
\ No newline at end of file
+    datetime_pst = as_utc(datetime).astimezone(pst)
+    return datetime_pst.strftime('%b %d')
@@ -0,0 +1,52 @@
+"""The scheduled jobs. These are run either as one-off commands through
+`cli.py` or periodically by the long-running scheduler in `scheduler.py`."""
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+
+def scrape():
+    """Scrape craigslist for recent postings in the past day and record the
+    attempt in the scrape log."""
+    # the craigslist client is only needed here, don't load it for every
+    # other job
+    from .scrape import scrape_craigslist
+
+    try:
+        listings = scrape_craigslist()
+    except Exception:
+        listings_added = None
+        models.ScrapeLog.add_stamp(listings_added, is_success=False)
+        raise
+    else:
+        listings_added = models.ApartmentListing.bulk_insert(listings)
+        models.ScrapeLog.add_stamp(listings_added)
+    return listings_added
+
+
+def update_neighborhoods(threshold=100):
+    """Inserts any new neighborhoods discovered and marks which ones are
+    active."""
+    models.Neighborhoods.create_hoods()
+    models.Neighborhoods.set_active(threshold)
+
+
+def run_bootstraps(date=None, trials=1000):
+    """Runs the bootstrap simulations for `date`, defaulting to yesterday."""
+    if date is None:
+        date = datetime.now().date() - timedelta(1)
+    models.ListingPriceStatistics.run_bootstrap(date, trials=trials)
+
+
+def compact_listings(days=None):
+    """Rolls up and archives listings older than `days`, defaulting to the
+    LISTING_RETENTION_DAYS setting."""
+    if days is None:
+        days = current_app.config['LISTING_RETENTION_DAYS']
+    return models.ArchivedApartmentListing.compact(days)
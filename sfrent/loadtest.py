@@ -0,0 +1,192 @@
+"""Offline load testing of the web views.
+
+`seed` fills a database with synthetic listings, statistics and sketches,
+and `run` starts the app under gunicorn against it for each worker count
+and measures latency and throughput per route. Nothing leaves the machine.
+"""
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+
+from . import db, utils
+from .models import ApartmentListing, Neighborhoods, ScrapeLog, \
+                    ListingPriceStatistics, ListingPriceSketch
+
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ('/', '/hoods/<id>/<slug>', '/scrape/logs')
+
+
+def seed(listings=20000, neighborhoods=20, days=180, seed=0):
+    """Recreates all tables in the current app's database and fills them
+    with `listings` synthetic listings spread over `days` days and
+    `neighborhoods` active neighborhoods, daily statistics over the same
+    `days` days for every neighborhood and for all of SF, and three days
+    of hourly scrape logs."""
+    rnd = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+
+    now = datetime.utcnow().replace(tzinfo=pytz.utc)
+    names = ['Neighborhood %d' % i for i in range(1, neighborhoods + 1)]
+    for name in names:
+        db.session.add(Neighborhoods(name=name, slug_text=utils.slugify(name),
+                                     is_active=True))
+
+    objs = []
+    for post_id in range(listings):
+        bedrooms = rnd.choice((0, 1, 2))
+        area = int(rnd.gauss(450 + 300 * bedrooms, 100))
+        objs.append(ApartmentListing(
+            post_id=post_id,
+            name='Synthetic listing %d' % post_id,
+            price=max(1000, int(rnd.gauss(2500 + 900 * bedrooms, 500))),
+            url='https://sfbay.craigslist.org/sfc/apa/d/%d.html' % post_id,
+            location=rnd.choice(names),
+            area=area if rnd.random() < 0.7 and area > 0 else None,
+            bedrooms=bedrooms,
+            posted=now - timedelta(seconds=rnd.uniform(0, days * 86400)),
+            latitude=37.7 + rnd.random() / 10,
+            longitude=-122.5 + rnd.random() / 10,
+            has_image=True,
+            has_map=True))
+    db.session.bulk_save_objects(objs)
+    ListingPriceSketch.add_listings(objs)
+
+    for location in [None] + names:
+        means = [2500., 3400., 4300.]
+        for day in range(days, 0, -1):
+            means = [m * rnd.uniform(0.99, 1.01) for m in means]
+            stats = {'date': now.date() - timedelta(day), 'location': location}
+            for bedrooms, mean in enumerate(means):
+                stats['lower%d' % bedrooms] = mean * 0.95
+                stats['mean%d' % bedrooms] = mean
+                stats['upper%d' % bedrooms] = mean * 1.05
+            db.session.add(ListingPriceStatistics(**stats))
+
+    for hour in range(72):
+        db.session.add(ScrapeLog(scrape_time=now - timedelta(hours=hour),
+                                 listings_added=rnd.randint(0, 40),
+                                 is_success=True))
+    db.session.commit()
+    logger.info("Seeded %s listings in %s neighborhoods", listings, neighborhoods)
+
+
+def run(database_uri, workers=(1, 2, 4), requests=500, concurrency=8,
+        port=8765):
+    """Starts gunicorn against `database_uri` once per worker count and
+    sends `requests` requests, `concurrency` at a time, spread evenly over
+    the routes. Returns {workers: {route: stats}} where stats has
+    requests, errors, and p50/p95/p99 latency in ms and requests per second
+    of the successful requests."""
+    hoods = [(h.id, h.slug_text) for h in Neighborhoods.get_active()]
+    if not hoods:
+        raise ValueError("No active neighborhoods to request, seed first")
+
+    rnd = random.Random(0)
+    paths = []
+    for i in range(requests):
+        route = ROUTES[i % len(ROUTES)]
+        if route == '/hoods/<id>/<slug>':
+            paths.append((route, '/hoods/%s/%s' % rnd.choice(hoods)))
+        else:
+            paths.append((route, route))
+
+    env = dict(os.environ, RENTTRACK_CONFIG='loadtest',
+               LOADTEST_DATABASE_URL=database_uri)
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    base_url = 'http://127.0.0.1:%d' % port
+
+    results = {}
+    for num_workers in workers:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'manage:app',
+             '--workers', str(num_workers), '--bind', '127.0.0.1:%d' % port,
+             '--log-level', 'warning'],
+            env=env, cwd=cwd)
+        try:
+            _wait_until_up(base_url, process)
+            # the first requests per worker pay for lazy imports and
+            # connecting to the database
+            for route, path in paths[:len(ROUTES) * num_workers * 2]:
+                _fetch(base_url + path)
+            results[num_workers] = _hammer(base_url, paths, concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+def _wait_until_up(base_url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with code %s" % process.returncode)
+        try:
+            urllib.request.urlopen(base_url + '/scrape/logs', timeout=5).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn didn't start within %s seconds" % timeout)
+
+
+def _fetch(url):
+    """Returns the seconds taken to fetch `url` and whether it succeeded."""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            response.read()
+        ok = True
+    except (urllib.error.URLError, ConnectionError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def _hammer(base_url, paths, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        timings = list(executor.map(lambda p: _fetch(base_url + p[1]), paths))
+    elapsed = time.perf_counter() - start
+
+    by_route = {}
+    for (route, _), (seconds, ok) in zip(paths, timings):
+        by_route.setdefault(route, []).append((seconds, ok))
+
+    stats = {}
+    for route in ROUTES:
+        timings = by_route.get(route, [])
+        if not timings:
+            continue
+        # failed requests (refused connections, quick 500s) would drag the
+        # percentiles down, they're only counted as errors
+        latencies = sorted(seconds * 1000 for seconds, ok in timings if ok)
+        stats[route] = {
+            'requests': len(timings),
+            'errors': len(timings) - len(latencies),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            # successful throughput of this route while sharing the server
+            # with the others
+            'rps': len(latencies) / elapsed,
+        }
+    return stats
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list, None if empty."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100. * len(sorted_values)))
+    return sorted_values[rank - 1]
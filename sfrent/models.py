@@ -4,24 +4,29 @@ from datetime import datetime, timedelta
 
 import pytz
 
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Date, Float, Boolean, BigInteger
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Date, Float, Boolean, BigInteger, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 
-from . import scrape
 from . import db
 from . import utils
+from .sketch import TDigest
 
 
 logger = logging.getLogger(__name__)
 
+# the longest window any page or statistic reads raw listings for
+MIN_RETENTION_DAYS = 56
 
-class ApartmentListing(db.Model):
-    __tablename__ = 'apartmentlistings'
+
+class ListingMixin:
+    """Columns shared by apartmentlistings and its archive. Compaction and
+    restore copy rows between the two by column name, so they must stay
+    identical."""
     id = Column(Integer, primary_key=True)
-    post_id = Column(BigInteger)
+    post_id = Column(BigInteger, index=True)
     name = Column(String(256))
     price = Column(Integer)
     url = Column(String(256))
@@ -34,6 +39,10 @@ class ApartmentListing(db.Model):
     has_image = Column(Boolean)
     has_map = Column(Boolean)
 
+
+class ApartmentListing(ListingMixin, db.Model):
+    __tablename__ = 'apartmentlistings'
+
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.url)
 
@@ -44,11 +53,16 @@ class ApartmentListing(db.Model):
     @classmethod
     def bulk_insert(cls, listings):
         num_inserts = 0
+        inserted = []
 
         for listing in listings:
-            # use the ID given by craigslist to dedupe listings:
-            inserted_listing = db.session.query(
-                ApartmentListing).filter_by(post_id=listing.post_id).first()
+            # use the ID given by craigslist to dedupe listings, including
+            # ones that have since been archived:
+            inserted_listing = (
+                db.session.query(ApartmentListing).filter_by(
+                    post_id=listing.post_id).first() or
+                db.session.query(ArchivedApartmentListing).filter_by(
+                    post_id=listing.post_id).first())
             if inserted_listing:
                 logger.info("Listing already inserted: %s" % listing.url)
                 continue
@@ -60,13 +74,17 @@ class ApartmentListing(db.Model):
                 location=listing.location,
                 area=listing.area,
                 bedrooms=listing.bedrooms,
-                posted=listing.posted,
+                # store UTC so sqlite, which drops the timezone, keeps the
+                # same instant postgres would
+                posted=utils.as_utc(listing.posted),
                 latitude=listing.latitude,
                 longitude=listing.longitude,
                 has_image=listing.has_image,
                 has_map=listing.has_map
             ))
+            inserted.append(listing)
             num_inserts += 1
+        ListingPriceSketch.add_listings(inserted)
         db.session.commit()
         logger.info("Inserted %s new listings" % num_inserts)
         return num_inserts
@@ -88,6 +106,209 @@ class ApartmentListing(db.Model):
         return query.order_by(cls.posted.desc()).limit(limit=limit).all()
 
 
+class ArchivedApartmentListing(ListingMixin, db.Model):
+    """Raw listings older than the retention horizon, moved out of
+    `apartmentlistings` so the table every page queries stays small. Rows
+    keep their original ids and can be moved back with `restore`."""
+    __tablename__ = 'apartmentlistings_archive'
+
+    @classmethod
+    def compact(cls, days=MIN_RETENTION_DAYS):
+        """Rolls up and archives every day of listings posted more than
+        `days` ago, one day per transaction. Returns the number of listings
+        archived."""
+        if days < MIN_RETENTION_DAYS:
+            raise ValueError(f"Listings are needed for at least {MIN_RETENTION_DAYS} days")
+        first_posted = db.session.query(func.min(ApartmentListing.posted)).scalar()
+        if first_posted is None:
+            return 0
+        cutoff = datetime.now().date() - timedelta(days)
+
+        num_archived = 0
+        day = utils.posting_day(first_posted)
+        while day <= cutoff:
+            if ListingDailyRollup.create_rollups(day):
+                num_archived += cls._move(ApartmentListing, cls, day)
+                db.session.commit()
+                logger.info("Archived listings posted on %s", day)
+            day += timedelta(1)
+        logger.info("Archived %s listings" % num_archived)
+        return num_archived
+
+    @classmethod
+    def restore(cls, start_date, end_date):
+        """Moves archived listings posted between `start_date` and
+        `end_date` back into apartmentlistings, e.g. to backfill
+        bootstraps. The next `compact` archives them again."""
+        num_restored = 0
+        day = start_date
+        while day <= end_date:
+            num_restored += cls._move(cls, ApartmentListing, day)
+            db.session.commit()
+            day += timedelta(1)
+        logger.info("Restored %s listings" % num_restored)
+        return num_restored
+
+    @staticmethod
+    def _move(source, destination, day):
+        start, end = utils.day_bounds(day)
+        source_table = source.__table__
+        columns = [column.name for column in source_table.columns]
+        rows = (select([source_table.c[c] for c in columns])
+                  .where(source_table.c.posted >= start)
+                  .where(source_table.c.posted < end))
+        db.session.execute(
+            destination.__table__.insert().from_select(columns, rows))
+        return (db.session.query(source)
+                  .filter(source.posted >= start)
+                  .filter(source.posted < end)
+                  .delete(synchronize_session=False))
+
+
+class ListingDailyRollup(db.Model):
+    """Per day, location and bedrooms aggregates of listings, kept forever
+    for long-range views after the raw rows have been archived."""
+    __tablename__ = 'listingdailyrollups'
+    id = Column(Integer, primary_key=True)
+    date = Column(Date)
+    location = Column(String(64))
+    bedrooms = Column(Integer)
+    listings = Column(Integer)
+    price_sum = Column(BigInteger)
+    price_p10 = Column(Float)
+    price_p25 = Column(Float)
+    price_p50 = Column(Float)
+    price_p75 = Column(Float)
+    price_p90 = Column(Float)
+
+    @classmethod
+    def create_rollups(cls, date):
+        """(Re)computes the rollups for listings posted on `date` (see
+        `utils.day_bounds`) from apartmentlistings. Days without any
+        listings there, e.g. ones already archived, are left alone. Returns
+        whether the day had listings. Doesn't commit."""
+        import numpy as np
+
+        start, end = utils.day_bounds(date)
+        listings = (db.session.query(ApartmentListing.location,
+                                     ApartmentListing.bedrooms,
+                                     ApartmentListing.price)
+                      .filter(ApartmentListing.posted >= start)
+                      .filter(ApartmentListing.posted < end)
+                      .all())
+        if not listings:
+            return False
+        groups = {}
+        for location, bedrooms, price in listings:
+            if price is not None:
+                groups.setdefault((location, bedrooms), []).append(price)
+
+        db.session.query(cls).filter(cls.date == date).delete(
+            synchronize_session=False)
+        for (location, bedrooms), prices in groups.items():
+            quantiles = np.percentile(prices, [10, 25, 50, 75, 90]).tolist()
+            db.session.add(cls(date=date, location=location,
+                               bedrooms=bedrooms, listings=len(prices),
+                               price_sum=sum(prices),
+                               price_p10=quantiles[0], price_p25=quantiles[1],
+                               price_p50=quantiles[2], price_p75=quantiles[3],
+                               price_p90=quantiles[4]))
+        return True
+
+
+class ListingPriceSketch(db.Model):
+    """t-digests of listing prices and prices per sqft for each posting day,
+    location and bedrooms. They're updated as listings are scraped and can
+    be merged over any date range for approximate percentiles, see
+    `merge`. Like ListingPriceStatistics, rows with location=NULL cover
+    all of SF, so city-wide ranges merge one row per day rather than one
+    per neighborhood."""
+    __tablename__ = 'listingpricesketches'
+    id = Column(Integer, primary_key=True)
+    date = Column(Date)
+    location = Column(String(64))
+    bedrooms = Column(Integer)
+    listings = Column(Integer)
+    price_digest = Column(Text)
+    price_per_sqft_digest = Column(Text)
+
+    @classmethod
+    def add_listings(cls, listings):
+        """Adds the prices of `listings` (anything with the attributes of an
+        ApartmentListing) to their sketches. Doesn't commit."""
+        groups = {}
+        for listing in listings:
+            if listing.price is None:
+                continue
+            day = utils.posting_day(listing.posted)
+            groups.setdefault((day, None, listing.bedrooms), []).append(listing)
+            if listing.location is not None:
+                key = (day, listing.location, listing.bedrooms)
+                groups.setdefault(key, []).append(listing)
+
+        for (date, location, bedrooms), _listings in groups.items():
+            sketch = (db.session.query(cls)
+                        .filter(cls.date == date)
+                        .filter(cls.location == location)
+                        .filter(cls.bedrooms == bedrooms)
+                        .first())
+            if sketch is None:
+                sketch = cls(date=date, location=location, bedrooms=bedrooms,
+                             listings=0)
+                db.session.add(sketch)
+
+            prices = TDigest.from_json(sketch.price_digest)
+            prices_per_sqft = TDigest.from_json(sketch.price_per_sqft_digest)
+            for listing in _listings:
+                prices.add(listing.price)
+                # leave out missing and implausible areas
+                if listing.area and 0 < listing.area < 4000:
+                    prices_per_sqft.add(listing.price / listing.area)
+            sketch.listings += len(_listings)
+            sketch.price_digest = prices.to_json()
+            sketch.price_per_sqft_digest = prices_per_sqft.to_json()
+
+    @classmethod
+    def merge(cls, start_date, end_date, location=None):
+        """Merges the sketches between two dates (inclusive) for `location`,
+        or all of SF if None. Returns a dict of bedrooms to a pair of
+        (price, price per sqft) TDigests."""
+        query = (db.session.query(cls.bedrooms, cls.price_digest,
+                                  cls.price_per_sqft_digest)
+                   .filter(cls.date >= start_date)
+                   .filter(cls.date <= end_date)
+                   .filter(cls.location == location))
+
+        merged = {}
+        for bedrooms, price_digest, price_per_sqft_digest in query.all():
+            if bedrooms not in merged:
+                merged[bedrooms] = (TDigest(), TDigest())
+            merged[bedrooms][0].merge(TDigest.from_json(price_digest))
+            merged[bedrooms][1].merge(TDigest.from_json(price_per_sqft_digest))
+        return merged
+
+    @classmethod
+    def rebuild(cls, start_date, end_date):
+        """Recreates the sketches between two dates from the raw listings,
+        including archived ones, one day per transaction. Days are selected
+        with `utils.day_bounds`, which matches the `utils.posting_day`
+        bucketing used when they're scraped, so a rebuild only ever touches
+        the day it deleted."""
+        day = start_date
+        while day <= end_date:
+            db.session.query(cls).filter(cls.date == day).delete(
+                synchronize_session=False)
+            start, end = utils.day_bounds(day)
+            for model in (ApartmentListing, ArchivedApartmentListing):
+                cls.add_listings(model.query
+                                   .filter(model.posted >= start)
+                                   .filter(model.posted < end)
+                                   .all())
+            db.session.commit()
+            logger.info("Rebuilt price sketches for %s", day)
+            day += timedelta(1)
+
+
 class Neighborhoods(db.Model):
     __tablename__ = 'neighborhoods'
     id = Column(Integer, primary_key=True)
@@ -172,6 +393,51 @@ class ScrapeLog(db.Model):
         return db.session.query(func.max(cls.scrape_time)).all()[0][0]
 
 
+class JobLog(db.Model):
+    """One row per scheduled job run, written by the scheduler."""
+    __tablename__ = 'joblog'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String(64))
+    started = Column(DateTime(timezone=True))
+    duration = Column(Float)
+    attempts = Column(Integer)
+    status = Column(String(16))
+    error = Column(String(256))
+
+    @classmethod
+    def add_entry(cls, job_name, started, status, duration=None, attempts=0,
+                  error=None):
+        """Records the outcome of a job run.
+
+        started: when the first attempt started
+        status: one of success, failed or skipped (the previous run was
+            still going or the job chose not to run)
+        duration: seconds taken across all attempts
+        error: repr of the last exception if the run failed
+        """
+        if error is not None:
+            error = error[:256]
+        db.session.add(cls(job_name=job_name, started=started,
+                           duration=duration, attempts=attempts,
+                           status=status, error=error))
+        db.session.commit()
+
+
+class PageSnapshot(db.Model):
+    """Pre-rendered pages, see `snapshots.py`. Kept in the database so the
+    dyno that renders them and the ones that serve them see the same
+    copy."""
+    __tablename__ = 'pagesnapshots'
+    path = Column(String(256), primary_key=True)
+    fingerprint = Column(String(40))
+    html = Column(Text)
+    rendered = Column(DateTime(timezone=True))
+
+
 class ListingPriceStatistics(db.Model):
     """Running table of bootstrapped mean prices for studios, 1 bedrooms and 
     2 bedrooms. I run bootstrap simulations nightly and store the data in
@@ -0,0 +1,229 @@
+"""A small in-process job scheduler.
+
+Instead of starting a fresh Python process for every job, one worker keeps
+the app, its database connection pool and any imported modules warm and
+runs each job on a cron-like schedule in its own thread."""
+import logging
+import random
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from . import db
+from .models import JobLog
+
+
+logger = logging.getLogger(__name__)
+
+# jobs return this to record a run that deliberately did nothing as skipped
+SKIP = object()
+
+
+class CronSchedule:
+    """Parses a subset of cron syntax: five whitespace separated fields for
+    minute, hour, day of month, month and day of week (0 = Sunday). Each
+    field can be `*`, `*/n`, `a`, `a/n`, `a-b`, `a-b/n` or a comma separated
+    list of those. Unlike cron, day of month and day of week must both match.
+    Times are in UTC."""
+
+    FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(self.FIELD_RANGES):
+            raise ValueError(f"Expected 5 fields in cron expression: {expression!r}")
+        self.expression = expression
+        (self.minutes, self.hours, self.days,
+         self.months, self.weekdays) = [
+            self._parse_field(field, lower, upper)
+            for field, (lower, upper) in zip(fields, self.FIELD_RANGES)]
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.expression)
+
+    @staticmethod
+    def _parse_field(field, lower, upper):
+        values = set()
+        for part in field.split(','):
+            step = None
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = lower, upper
+            elif '-' in part:
+                start, end = map(int, part.split('-'))
+            elif step is not None:
+                # like cron, `a/n` is every n starting at a
+                start, end = int(part), upper
+            else:
+                start = end = int(part)
+            if step is None:
+                step = 1
+            if not lower <= start <= end <= upper or step < 1:
+                raise ValueError(f"Invalid cron field: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def next_after(self, dt):
+        """Returns the first matching minute strictly after `dt`."""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # give up on expressions that can never match, e.g. February 30th
+        limit = dt + timedelta(days=5 * 366)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif (dt.day not in self.days or
+                    (dt.weekday() + 1) % 7 not in self.weekdays):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+class Job:
+    """A function run on a schedule.
+
+    name: used in logs and the joblog table
+    func: called with no arguments inside an app context, may return
+        `SKIP` if it decided not to do anything this run
+    schedule: cron expression, see `CronSchedule`
+    jitter: random delay of up to this many seconds added to each run
+    retries: how many times to retry a failed run
+    backoff: seconds to wait before the first retry, doubled for each one
+        after that
+    """
+
+    def __init__(self, name, func, schedule, jitter=0, retries=0, backoff=60):
+        self.name = name
+        self.func = func
+        self.schedule = CronSchedule(schedule)
+        self.jitter = jitter
+        self.retries = retries
+        self.backoff = backoff
+        self.next_slot = None
+        self.next_run = None
+        self._running = threading.Lock()
+
+    def __repr__(self):
+        return '<%s %s %s>' % (self.__class__.__name__, self.name,
+                               self.schedule.expression)
+
+    def schedule_next(self, now):
+        # step from the un-jittered slot so jitter can't push a job past its
+        # next slot and make it skip a run
+        self.next_slot = self.schedule.next_after(max(now, self.next_slot or now))
+        self.next_run = self.next_slot + timedelta(
+            seconds=random.uniform(0, self.jitter))
+        logger.info("Next run of %s at %s UTC", self.name, self.next_run)
+
+
+class Scheduler:
+    """Runs jobs in background threads of a single long-lived process.
+
+    A job that is still running when its next run comes up is skipped
+    rather than started twice. Every run, retry count, duration and outcome
+    is written to the joblog table.
+    """
+
+    def __init__(self, app, poll_interval=30):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.jobs = []
+        self._threads = []
+        self._stop = threading.Event()
+
+    def add_job(self, name, func, schedule, **kwargs):
+        job = Job(name, func, schedule, **kwargs)
+        self.jobs.append(job)
+        return job
+
+    def stop(self, *args):
+        logger.info("Stopping scheduler.")
+        self._stop.set()
+
+    def run(self, shutdown_timeout=20):
+        """Blocks until SIGINT/SIGTERM, then waits up to `shutdown_timeout`
+        seconds for running jobs to finish."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        now = datetime.utcnow()
+        for job in self.jobs:
+            job.schedule_next(now)
+
+        while not self._stop.is_set():
+            now = datetime.utcnow()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    self._start(job)
+                    job.schedule_next(now)
+            self._threads = [t for t in self._threads if t.is_alive()]
+
+            wait = min(job.next_run for job in self.jobs) - datetime.utcnow()
+            self._stop.wait(max(0, min(wait.total_seconds(), self.poll_interval)))
+
+        # one deadline for all jobs, Heroku kills the process 30 seconds
+        # after SIGTERM
+        deadline = time.time() + shutdown_timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
+
+    def _start(self, job):
+        if not job._running.acquire(blocking=False):
+            logger.warning("%s is still running, skipping this run.", job.name)
+            with self.app.app_context():
+                JobLog.add_entry(job.name, utcnow(), status=JobLog.SKIPPED)
+            return
+        thread = threading.Thread(target=self._run_job, args=(job,),
+                                  name=job.name, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _run_job(self, job):
+        try:
+            with self.app.app_context():
+                started = utcnow()
+                clock = time.time()
+                attempts, error, result = 0, None, None
+                while True:
+                    attempts += 1
+                    logger.info("Running %s (attempt %s)", job.name, attempts)
+                    try:
+                        result = job.func()
+                    except Exception as e:
+                        logger.exception("%s failed", job.name)
+                        db.session.rollback()
+                        error = repr(e)
+                    else:
+                        error = None
+                        break
+                    if attempts > job.retries:
+                        break
+                    delay = job.backoff * 2 ** (attempts - 1)
+                    logger.info("Retrying %s in %s seconds", job.name, delay)
+                    if self._stop.wait(delay):
+                        break
+
+                if error:
+                    status = JobLog.FAILED
+                elif result is SKIP:
+                    status = JobLog.SKIPPED
+                else:
+                    status = JobLog.SUCCESS
+                JobLog.add_entry(job.name, started, status=status,
+                                 duration=time.time() - clock,
+                                 attempts=attempts, error=error)
+        finally:
+            job._running.release()
+
+
+def utcnow():
+    return datetime.utcnow().replace(tzinfo=pytz.utc)
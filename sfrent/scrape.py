@@ -64,7 +64,9 @@ class ApartmentListing:
                    ) if data['area'] is not None else None
         bedrooms = int(data['bedrooms']) if data['bedrooms'] else 0
         posted = datetime.strptime(data['datetime'], '%Y-%m-%d %H:%M')
-        posted = posted.replace(tzinfo=pytz.timezone('US/Pacific'))
+        # localize rather than replace(tzinfo=...), which would give pytz's
+        # local mean time offset (-7:53) instead of PST/PDT
+        posted = pytz.timezone('US/Pacific').localize(posted)
         latitude, longitude = data['geotag'] if data['geotag'] else (
             None, None)
         has_image = data['has_image']
@@ -0,0 +1,126 @@
+"""Mergeable quantile sketches.
+
+A t-digest summarises a distribution as a short list of weighted centroids,
+small ones near the tails and bigger ones around the median. Two digests
+can be merged into one, so a digest stored per day can be combined over any
+date range to answer percentile queries without touching raw listings.
+
+https://arxiv.org/abs/1902.04023
+"""
+import json
+import math
+
+
+class TDigest:
+    """A merging t-digest. `compression` bounds the number of centroids
+    (roughly 2x that at most); higher is more accurate and bigger."""
+
+    def __init__(self, compression=100, centroids=None, min=None, max=None):
+        self.compression = compression
+        # sorted [mean, weight] pairs
+        self.centroids = [list(c) for c in centroids or []]
+        self.min = min
+        self.max = max
+        self._buffer = []
+
+    def __repr__(self):
+        return '<%s count=%s centroids=%s>' % (
+            self.__class__.__name__, self.count, len(self.centroids))
+
+    @property
+    def count(self):
+        return (sum(weight for _, weight in self.centroids) +
+                sum(weight for _, weight in self._buffer))
+
+    def add(self, value, weight=1):
+        self._buffer.append([value, weight])
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self._buffer) > 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """Adds everything summarised by `other` to this digest. Like `add`,
+        centroids are buffered and only compressed once the buffer is full,
+        so merging many digests costs one sort per few hundred of them."""
+        self._buffer.extend(list(c) for c in other.centroids + other._buffer)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        if len(self._buffer) > 5 * self.compression:
+            self._compress()
+        return self
+
+    def quantile(self, q):
+        """Approximate value at quantile `q` (0-1), None if empty."""
+        self._compress()
+        if not self.centroids:
+            return None
+        total = self.count
+        target = q * total
+        # interpolate between centroid centres, anchored on the exact min
+        # and max at either end
+        previous_center, previous_mean = 0, self.min
+        cumulative = 0
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                if center == previous_center:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (
+                    (target - previous_center) / (center - previous_center))
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        if total == previous_center:
+            return self.max
+        return previous_mean + (self.max - previous_mean) * (
+            (target - previous_center) / (total - previous_center))
+
+    def to_json(self):
+        self._compress()
+        return json.dumps({
+            'compression': self.compression,
+            'centroids': [[round(mean, 4), weight] for mean, weight in self.centroids],
+            'min': self.min,
+            'max': self.max,
+        }, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        if not text:
+            return cls()
+        return cls(**json.loads(text))
+
+    def _k(self, q):
+        # the k1 scale function; a centroid may span at most 1 unit of k
+        q = min(max(q, 0.), 1.)
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q_limit(self, q):
+        # the furthest quantile a centroid starting at `q` may reach, i.e.
+        # where _k has grown by 1, so _compress needn't call _k per point
+        k = self._k(q) + 1
+        if k >= self.compression / 4:
+            return 1.
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(self.centroids + self._buffer)
+        total = sum(weight for _, weight in points)
+
+        merged = [points[0]]
+        weight_before = 0
+        weight_limit = total * self._q_limit(0)
+        for mean, weight in points[1:]:
+            current = merged[-1]
+            if weight_before + current[1] + weight <= weight_limit:
+                current[1] += weight
+                current[0] += (mean - current[0]) * weight / current[1]
+            else:
+                weight_before += current[1]
+                weight_limit = total * self._q_limit(weight_before / total)
+                merged.append([mean, weight])
+        self.centroids = merged
+        self._buffer = []
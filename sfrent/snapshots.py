@@ -0,0 +1,223 @@
+"""Pre-rendered copies of the home page and neighborhood pages.
+
+Between scrapes and the nightly bootstraps these pages don't change, so
+`render_snapshots` renders them ahead of time and `serve_snapshot` returns
+them before the views (and their queries) ever run. Snapshots are kept in
+one of two places:
+
+- the pagesnapshots table when SNAPSHOTS_IN_DATABASE is set. This is the
+  setup for Heroku, where the worker dyno that renders and the web dynos
+  that serve don't share a filesystem. Serving costs one primary key
+  lookup.
+- html files in STATIC_SNAPSHOT_DIR, for a single host where the renderer
+  and gunicorn share a disk, or to upload to a CDN.
+
+Pages without a snapshot fall back to the normal views.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+import pytz
+from flask import current_app, request, safe_join, send_file, url_for
+from sqlalchemy import func
+from werkzeug.exceptions import NotFound
+
+from . import db, views
+from .models import ApartmentListing, Neighborhoods, ListingPriceStatistics, \
+                    ScrapeLog, PageSnapshot, ListingPriceSketch
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+
+def page_path(endpoint, view_args):
+    """The key a page's snapshot is stored under, also its path relative to
+    the snapshot directory. None for pages that aren't snapshotted."""
+    if endpoint == 'home':
+        return 'index.html'
+    if endpoint == 'hood':
+        return 'hoods/%s/%s.html' % (view_args['neighborhood_id'],
+                                     view_args['slug'])
+    return None
+
+
+def serve_snapshot():
+    """`before_request` hook returning the snapshot of the requested page
+    if one has been rendered."""
+    if request.method != 'GET' or request.url_rule is None:
+        return None
+    path = page_path(request.url_rule.endpoint, request.view_args)
+    if path is None:
+        return None
+    max_age = current_app.config['STATIC_SNAPSHOT_MAX_AGE']
+
+    if current_app.config['SNAPSHOTS_IN_DATABASE']:
+        snapshot = db.session.query(PageSnapshot).get(path)
+        if snapshot is None:
+            return None
+        response = current_app.response_class(snapshot.html,
+                                              mimetype='text/html')
+        # the render time too, a forced re-render (e.g. after a template
+        # change) keeps the fingerprint
+        response.set_etag('%s-%d' % (snapshot.fingerprint,
+                                     snapshot.rendered.timestamp()))
+        response.last_modified = snapshot.rendered
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response.make_conditional(request)
+
+    try:
+        filename = safe_join(current_app.config['STATIC_SNAPSHOT_DIR'], path)
+    except NotFound:
+        return None
+    if not os.path.isfile(filename):
+        return None
+    return send_file(filename, mimetype='text/html', conditional=True,
+                     cache_timeout=max_age)
+
+
+class DirectoryStore:
+    """Snapshots as html files, fingerprints in manifest.json. Files are
+    written atomically so a reader never sees a half written page."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except (IOError, ValueError):
+            self.manifest = {}
+
+    def fingerprints(self):
+        return {path: fingerprint for path, fingerprint in self.manifest.items()
+                if os.path.isfile(os.path.join(self.directory, path))}
+
+    def write(self, path, html, fingerprint):
+        _write_atomic(os.path.join(self.directory, path), html.encode('utf-8'))
+        self.manifest[path] = fingerprint
+
+    def remove(self, path):
+        filename = os.path.join(self.directory, path)
+        if os.path.isfile(filename):
+            os.remove(filename)
+        self.manifest.pop(path, None)
+
+    def save(self):
+        _write_atomic(os.path.join(self.directory, MANIFEST),
+                      json.dumps(self.manifest, indent=2).encode())
+
+
+class DatabaseStore:
+    """Snapshots in the pagesnapshots table, replaced in one transaction."""
+
+    def fingerprints(self):
+        return dict(db.session.query(PageSnapshot.path,
+                                     PageSnapshot.fingerprint).all())
+
+    def write(self, path, html, fingerprint):
+        db.session.merge(PageSnapshot(
+            path=path, html=html, fingerprint=fingerprint,
+            rendered=datetime.utcnow().replace(tzinfo=pytz.utc)))
+
+    def remove(self, path):
+        db.session.query(PageSnapshot).filter(
+            PageSnapshot.path == path).delete(synchronize_session=False)
+
+    def save(self):
+        db.session.commit()
+
+
+def render_snapshots(app, output_dir=None, force=False):
+    """Renders the home page and every active neighborhood page into
+    `output_dir`, or the pagesnapshots table if None. A page is only
+    re-rendered when the data it shows has changed since the last run,
+    unless `force` is set. Snapshots of neighborhoods that are no longer
+    active are removed.
+
+    Returns the number of pages rendered, skipped and removed.
+    """
+    store = DirectoryStore(output_dir) if output_dir else DatabaseStore()
+    existing = store.fingerprints()
+
+    # every page lists the active neighborhoods in the navbar and the time
+    # of the last scrape in the footer, and the 28/56 day windows move every
+    # day. Relative times are filled in by the browser so they don't go
+    # stale between renders.
+    shared = [datetime.now().date(),
+              [(h.id, h.name, h.slug_text) for h in Neighborhoods.get_active()],
+              ScrapeLog.latest_stamp()]
+
+    pages = [('home', {}, views.ShowHome(), _home_inputs())]
+    for hood in Neighborhoods.get_active():
+        view_args = {'neighborhood_id': hood.id, 'slug': hood.slug_text}
+        pages.append(('hood', view_args, views.ShowNeighborhood(),
+                      _neighborhood_inputs(hood)))
+
+    rendered = skipped = 0
+    current = set()
+    for endpoint, view_args, view, inputs in pages:
+        path = page_path(endpoint, view_args)
+        current.add(path)
+        fingerprint = hashlib.sha1(
+            json.dumps(shared + inputs, default=str).encode()).hexdigest()
+        if not force and existing.get(path) == fingerprint:
+            skipped += 1
+            continue
+
+        with app.test_request_context():
+            url = url_for(endpoint, **view_args)
+        with app.test_request_context(url):
+            html = view.dispatch_request(**view_args)
+        store.write(path, html, fingerprint)
+        logger.info("Rendered %s", url)
+        rendered += 1
+
+    removed = 0
+    for path in set(existing) - current:
+        store.remove(path)
+        logger.info("Removed stale snapshot %s", path)
+        removed += 1
+
+    store.save()
+    return rendered, skipped, removed
+
+
+def _home_inputs():
+    return [db.session.query(func.max(ApartmentListing.id)).scalar(),
+            db.session.query(func.max(ListingPriceStatistics.id)).scalar()]
+
+
+def _neighborhood_inputs(hood):
+    # statistics are deleted and re-inserted when a bootstrap is rerun, and
+    # sketches when rebuild_sketches is run, so the max ids change then too
+    return [db.session.query(func.max(ApartmentListing.id))
+              .filter(ApartmentListing.location == hood.name).scalar(),
+            db.session.query(func.max(ListingPriceStatistics.id))
+              .filter(ListingPriceStatistics.location == hood.name).scalar(),
+            list(db.session.query(func.max(ListingPriceSketch.id),
+                                  func.count(ListingPriceSketch.id))
+                   .filter(ListingPriceSketch.location == hood.name).one())]
+
+
+def _write_atomic(filename, data):
+    """Writes to a temporary file next to `filename` and renames it into
+    place."""
+    dirname = os.path.dirname(filename)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
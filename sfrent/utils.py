@@ -1,8 +1,13 @@
 import re
+import subprocess
+import sys
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
 from unicodedata import normalize
 
-import pandas as pd
-import numpy as np
+import pytz
+
+PACIFIC = pytz.timezone('US/Pacific')
 
 _punct_re = re.compile(r'[\t !"#$%&\'()*\-/<=>?@\[\\\]^_`{|},.]+')
 
@@ -17,7 +22,35 @@ def slugify(text, delim='-'):
     return delim.join(result)
 
 
+def as_utc(dt):
+    """Converts `dt` to an aware UTC datetime. Listings are stored in UTC
+    (see `ApartmentListing.bulk_insert`) and sqlite drops the timezone, so
+    naive datetimes read back from it are UTC."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=pytz.utc)
+    return dt.astimezone(pytz.utc)
+
+
+def posting_day(posted):
+    """The San Francisco calendar day a listing was posted on."""
+    return as_utc(posted).astimezone(PACIFIC).date()
+
+
+def day_bounds(day):
+    """The UTC times a San Francisco calendar day starts and ends at, so
+    `start <= posted < end` selects exactly the listings whose
+    `posting_day` is `day`. Rollups, archiving and sketches all split
+    listings into days this way."""
+    start = PACIFIC.localize(datetime.combine(day, time()))
+    end = PACIFIC.localize(datetime.combine(day + timedelta(1), time()))
+    return start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+
+
 def bootstrap(values, trials=1000):
+    # pandas/numpy are only needed by the nightly jobs, so they're imported
+    # here rather than at module load to keep web workers light.
+    import pandas as pd
+
     replicates = []
     for _ in range(trials):
         replicate = values.sample(frac=1., replace=True).mean()
@@ -26,6 +59,9 @@ def bootstrap(values, trials=1000):
 
 
 def trim_outliers(values, percentile=95):
+    import numpy as np
+    import pandas as pd
+
     values = pd.Series(values).sort_values()
     if len(values) < 20:
         trimmed = values[2:-2]
@@ -38,3 +74,77 @@ def trim_outliers(values, percentile=95):
         trimmed = values[(lower < values) & (values < upper)]
     assert len(trimmed) > 0
     return trimmed
+
+
+
+def aggregate(points, period):
+    """Averages `(date, values)` points, sorted by date, into one point per
+    'week' (starting Monday) or 'month'. `values` is a list of numbers;
+    Nones are left out of the averages."""
+    buckets = OrderedDict()
+    for dt, values in points:
+        if period == 'week':
+            key = dt - timedelta(dt.weekday())
+        elif period == 'month':
+            key = dt.replace(day=1)
+        else:
+            raise ValueError(f"Unknown period: {period}")
+        buckets.setdefault(key, []).append(values)
+
+    aggregated = []
+    for key, rows in buckets.items():
+        means = []
+        for column in zip(*rows):
+            column = [v for v in column if v is not None]
+            means.append(sum(column) / len(column) if column else None)
+        aggregated.append((key, means))
+    return aggregated
+
+
+def lttb(points, threshold):
+    """Downsamples `(x, values)` points, sorted by x, to `threshold` points
+    using Largest-Triangle-Three-Buckets, which keeps the peaks and troughs
+    that plain averaging would flatten. The points are chosen on values[0];
+    the other values (e.g. confidence bands) come along with them.
+
+    https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf
+    """
+    if threshold < 3:
+        raise ValueError("Need at least 3 points to keep both ends")
+    if len(points) <= threshold:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    previous = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_bucket = points[end:min(int((i + 2) * bucket_size) + 1, len(points))]
+        avg_x = sum(x for x, _ in next_bucket) / len(next_bucket)
+        avg_y = sum(values[0] for _, values in next_bucket) / len(next_bucket)
+
+        ax, ay = points[previous][0], points[previous][1][0]
+        best, best_area = start, -1
+        for j in range(start, end):
+            x, y = points[j][0], points[j][1][0]
+            # twice the area of the triangle between the last chosen point,
+            # this one and the average of the next bucket
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        previous = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def measure_import(module, cwd=None):
+    """Imports `module` in a fresh interpreter and returns how many seconds
+    the import took. Running in a subprocess means nothing already imported
+    in this process skews the number."""
+    code = ('import time; start = time.perf_counter(); import {}; '
+            'print(time.perf_counter() - start)').format(module)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=cwd,
+                                     stderr=subprocess.DEVNULL)
+    return float(output)
@@ -1,16 +1,17 @@
+import calendar
 import json
 from datetime import datetime, timedelta
+from operator import itemgetter
 
 from flask import Blueprint, render_template, abort, jsonify, request, \
                   redirect, url_for
 from flask.views import View
 
 from sqlalchemy import func
-import pandas as pd
 
-from . import models, db
+from . import models, db, utils
 from .models import ApartmentListing, Neighborhoods, ListingPriceStatistics, \
-                    ScrapeLog
+                    ScrapeLog, ListingDailyRollup, ListingPriceSketch
 
 
 BEDROOM_TYPES = {
@@ -19,6 +20,19 @@ BEDROOM_TYPES = {
     2: '2BR'
 }
 
+# the pages show the last 180 days of prices; longer ranges come from the
+# api and are downsampled to a fixed number of points per series
+TSERIES_DAYS = 180
+TSERIES_POINTS = 180
+MAX_TSERIES_POINTS = 1000
+TSERIES_METHODS = ('lttb', 'week', 'month')
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+# default ranges for the neighborhood box plots and the quantiles api,
+# both ends of a range are included
+DISTRIBUTION_DAYS = 56
+QUANTILE_DAYS = 28
+
 
 def get_object_or_404(model, id):
     obj = db.session.query(model).get(id)
@@ -27,17 +41,92 @@ def get_object_or_404(model, id):
     return obj
 
 
-def dump_json(dataframe):
+def parse_date(value):
+    """Parses an optional YYYY-MM-DD query parameter."""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def to_date(value):
+    """`func.DATE` comes back as a string on sqlite and as a date on
+    postgres."""
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def dump_json(rows):
+    """Formats time series rows of `(date, {bedrooms: value})`, sorted by
+    date, into one nvd3 series per bedroom type. Dates are sent as epoch
+    seconds at midnight UTC."""
     data = []
-    dts = dataframe.index.map(lambda x: x.timestamp())
-    for col in dataframe.columns:
-        d = {'key': BEDROOM_TYPES[col]}
-        d['values'] = [{'x': x, 'y': y}
-                       for x, y in zip(dts, dataframe[col].values.tolist())]
-        data.append(d)
+    for bedrooms, key in BEDROOM_TYPES.items():
+        values = [{'x': calendar.timegm(dt.timetuple()), 'y': row[bedrooms]}
+                  for dt, row in rows if bedrooms in row]
+        data.append({'key': key, 'values': values})
     return json.dumps(data)
 
 
+def create_price_tseries(location, start=None, end=None, bands=False,
+                         points=TSERIES_POINTS, method='lttb'):
+    """Bootstrapped mean prices for `location` (None for all of SF) as nvd3
+    series, one per bedroom type plus its 5%/95% bands if `bands` is set.
+
+    method: 'lttb' picks the `points` most representative days, 'week' or
+        'month' first averages by period (and is then downsampled to
+        `points` too if that's still more)
+    """
+    model = ListingPriceStatistics
+    query = model.query.filter(model.location == location)
+    if start is not None:
+        query = query.filter(model.date >= start)
+    if end is not None:
+        query = query.filter(model.date <= end)
+    stats = query.order_by(model.date).all()
+
+    data = []
+    for bedrooms, key in BEDROOM_TYPES.items():
+        columns = ['mean%d' % bedrooms]
+        labels = [key]
+        if bands:
+            columns += ['lower%d' % bedrooms, 'upper%d' % bedrooms]
+            labels += [key + ' (5%)', key + ' (95%)']
+
+        rows = [(s.date, [getattr(s, c) for c in columns]) for s in stats
+                if getattr(s, columns[0]) is not None]
+        if method != 'lttb':
+            rows = utils.aggregate(rows, method)
+        rows = [(calendar.timegm(dt.timetuple()), values) for dt, values in rows]
+        rows = utils.lttb(rows, points)
+
+        for i, label in enumerate(labels):
+            data.append({'key': label,
+                         'values': [{'x': x, 'y': values[i]} for x, values in rows]})
+    return data
+
+
+def create_price_quantiles(location, start, end):
+    """Approximate percentiles of price and price per sqft for each bedroom
+    type, merged from the price sketches between two dates. `location` None
+    means all of SF."""
+    merged = ListingPriceSketch.merge(start, end, location=location)
+    quantiles = []
+    for bedrooms, key in BEDROOM_TYPES.items():
+        if bedrooms not in merged:
+            continue
+        prices, prices_per_sqft = merged[bedrooms]
+        quantiles.append({
+            'bedrooms': key,
+            'listings': prices.count,
+            'price': {'p%d' % round(q * 100): prices.quantile(q)
+                      for q in QUANTILES},
+            'price_per_sqft': {'p%d' % round(q * 100): prices_per_sqft.quantile(q)
+                               for q in QUANTILES},
+        })
+    return quantiles
+
+
 class ShowHome(View):
 
     def dispatch_request(self):
@@ -51,7 +140,7 @@ class ShowHome(View):
 
         return render_template('home.html', recent_listings=recent_listings,
                  table_listings=postings, tseries_data=tseries,
-                revenue_listings=revenue)
+                revenue_listings=revenue, bedroom_types=BEDROOM_TYPES.values())
 
     def create_postings(self, active_neighborhoods):
         post_date = func.DATE(ApartmentListing.posted)
@@ -65,13 +154,14 @@ class ShowHome(View):
                       .filter(ApartmentListing.location.in_(active_neighborhoods)) 
                       .all())
 
-        df = pd.DataFrame(postings, columns=['location', 'bedrooms', 'listings'])
-        df = (df.set_index(['location', 'bedrooms'])['listings']
-                .unstack('bedrooms')
-                .fillna(0)
-                .rename(columns=BEDROOM_TYPES))
-
-        return df
+        counts = {}
+        for location, bedrooms, listings in postings:
+            if bedrooms not in BEDROOM_TYPES:
+                continue
+            row = counts.setdefault(
+                location, {key: 0 for key in BEDROOM_TYPES.values()})
+            row[BEDROOM_TYPES[bedrooms]] = listings
+        return sorted(counts.items(), key=itemgetter(0))
 
     def create_revenue(self, active_neighborhoods):
         latest_dt = db.session.query(func.max(ListingPriceStatistics.date)).all()[0][0] - timedelta(1)
@@ -80,26 +170,16 @@ class ShowHome(View):
                      .filter(ListingPriceStatistics.location.in_(active_neighborhoods))
                      .all())
 
-        rows = [(s.location, s.mean0, s.mean1, s.mean2) for s in stats]
-        df = pd.DataFrame(rows, columns=['location', 0, 1, 2])
-        df = df.melt('location', [0,1,2], var_name='bedrooms', 
-                     value_name='price')
-        df = (df.set_index(['location', 'bedrooms'])['price']
-                .unstack('bedrooms')
-                .rename(columns=BEDROOM_TYPES)
-                .sort_index())
-        return df
+        rows = [(s.location, {BEDROOM_TYPES[0]: s.mean0,
+                              BEDROOM_TYPES[1]: s.mean1,
+                              BEDROOM_TYPES[2]: s.mean2}) for s in stats]
+        return sorted(rows, key=itemgetter(0))
 
     def create_tseries(self):
-        model = ListingPriceStatistics
-        since = datetime.now().date() - timedelta(180)
-        tseries = model.query.filter(model.date > since).filter(model.location == None).all()
-
-        df = pd.DataFrame([(t.date, t.mean0,  t.mean1, t.mean2) for t in tseries], 
-                          columns=['date', 0, 1, 2])
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.set_index('date').sort_index()
-        return dump_json(df)
+        # start is inclusive, keep it at TSERIES_DAYS days so the default
+        # chart is never downsampled
+        since = datetime.now().date() - timedelta(TSERIES_DAYS - 1)
+        return json.dumps(create_price_tseries(None, start=since))
 
 
 class ShowNeighborhood(View):
@@ -114,58 +194,121 @@ class ShowNeighborhood(View):
                             days=28, 
                             location=neighborhood.name
                           )
-        scatter = self.create_scatter(neighborhood)
+        quantiles, distribution = self.create_distribution(neighborhood)
         tseries = self.create_tseries(neighborhood)
         return render_template('neighborhood.html', hood=neighborhood,
                                recent_listings=recent_listings,
-                               scatter_data=scatter,
+                               quantiles=quantiles,
+                               distribution_data=distribution,
                                tseries_data=tseries)
 
-    def create_scatter(self, neighborhood):
-        post_date = func.DATE(ApartmentListing.posted)
-        since = datetime.now().date() -timedelta(56)
-        postings = (ApartmentListing.query
-                     .filter(ApartmentListing.area > 0) 
-                     .filter(ApartmentListing.area < 4000) 
-                     .filter(post_date > since) 
-                     .filter(ApartmentListing.location == neighborhood.name) 
-                     .order_by(ApartmentListing.posted.desc()) 
-                     .limit(250)
-                     .all())
-
-        data = {k: [] for k in BEDROOM_TYPES}
-        for listing in postings:
-            data[listing.bedrooms].append({
-                'x': listing.area, 
-                'y': listing.price / listing.area
-            })
-        data = [{'key': BEDROOM_TYPES[k], 'values': v} for k, v in data.items()]
-        return json.dumps(data)
+    def create_distribution(self, neighborhood):
+        """Price per sqft box plots for the past 56 days, from the price
+        sketches rather than a sample of listings."""
+        today = datetime.now().date()
+        quantiles = create_price_quantiles(neighborhood.name,
+                                           today - timedelta(DISTRIBUTION_DAYS - 1),
+                                           today)
+        data = []
+        for q in quantiles:
+            p = q['price_per_sqft']
+            if p['p50'] is None:
+                continue
+            data.append({'label': q['bedrooms'], 'values': {
+                'whisker_low': p['p10'], 'Q1': p['p25'], 'Q2': p['p50'],
+                'Q3': p['p75'], 'whisker_high': p['p90'], 'outliers': []}})
+        return quantiles, json.dumps(data)
 
     def create_tseries(self, neighborhood):
-        model = ListingPriceStatistics
-        since = datetime.now().date() - timedelta(180)
-        tseries = model.query.filter(model.date > since).filter(model.location == neighborhood.name).all()
-
-        df = pd.DataFrame([(t.date, t.mean0,  t.mean1, t.mean2) for t in tseries], 
-                          columns=['date', 0, 1, 2])
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.set_index('date').sort_index()
-        return dump_json(df)
+        since = datetime.now().date() - timedelta(TSERIES_DAYS - 1)
+        return json.dumps(create_price_tseries(neighborhood.name, start=since))
+
+
+class ShowPriceSeries(View):
+    """JSON price time series for all of SF or a neighborhood over any date
+    range. Query parameters:
+
+    start, end: YYYY-MM-DD, default to the full history
+    bands: 1 to include the 5%/95% bootstrap bands
+    points: maximum points per series
+    method: lttb, week or month
+    """
+
+    def dispatch_request(self, neighborhood_id=None):
+        location = None
+        if neighborhood_id is not None:
+            location = get_object_or_404(Neighborhoods, neighborhood_id).name
+
+        try:
+            start = parse_date(request.args.get('start'))
+            end = parse_date(request.args.get('end'))
+            points = int(request.args.get('points', TSERIES_POINTS))
+        except ValueError:
+            abort(400)
+        method = request.args.get('method', 'lttb')
+        if not 3 <= points <= MAX_TSERIES_POINTS or method not in TSERIES_METHODS:
+            abort(400)
+        bands = request.args.get('bands', '0') not in ('0', 'false', '')
+
+        return jsonify(create_price_tseries(location, start=start, end=end,
+                                            bands=bands, points=points,
+                                            method=method))
+
+
+class ShowPriceQuantiles(View):
+    """JSON approximate price and price per sqft percentiles for all of SF
+    or a neighborhood. Query parameters:
+
+    start, end: YYYY-MM-DD, default to the past 28 days
+    """
+
+    def dispatch_request(self, neighborhood_id=None):
+        location = None
+        if neighborhood_id is not None:
+            location = get_object_or_404(Neighborhoods, neighborhood_id).name
+
+        try:
+            end = parse_date(request.args.get('end')) or datetime.now().date()
+            start = (parse_date(request.args.get('start')) or
+                     end - timedelta(QUANTILE_DAYS - 1))
+        except ValueError:
+            abort(400)
+        return jsonify(create_price_quantiles(location, start, end))
 
 
 class ShowScrapes(View):
 
     def dispatch_request(self):
         recent_scrapes = ScrapeLog.query.order_by(ScrapeLog.scrape_time.desc()).limit(36)
-        total_postings = ApartmentListing.query.count()
-        first_posting = ApartmentListing.query.order_by(ApartmentListing.posted).first().posted
+        total_postings, first_posting = self.get_totals()
         avg_scrapes = self.get_average_scrapes()
         tseries = self.create_tseries()
         return render_template('scrapes.html', recent_scrapes=recent_scrapes, 
                                total_postings=total_postings, first_posting=first_posting,
                                tseries_data=tseries, avg_scrapes=avg_scrapes)
 
+    def get_totals(self):
+        """Number of listings ever scraped and the date of the first one.
+        Days that have been compacted are counted from their rollups, so
+        this doesn't scan the archive; only listings posted after the last
+        compacted day (including any restored ones) are counted from
+        apartmentlistings."""
+        rollup = ListingDailyRollup
+        rolled_up, first_day, last_day = db.session.query(
+            func.sum(rollup.listings), func.min(rollup.date),
+            func.max(rollup.date)).one()
+
+        recent = ApartmentListing.query
+        if last_day is not None:
+            start, _ = utils.day_bounds(last_day + timedelta(1))
+            recent = recent.filter(ApartmentListing.posted >= start)
+        total_postings = (rolled_up or 0) + recent.count()
+
+        if first_day is not None:
+            return total_postings, first_day
+        first_posting = db.session.query(func.min(ApartmentListing.posted)).scalar()
+        return total_postings, first_posting
+
     def get_average_scrapes(self):
         post_date = func.DATE(ApartmentListing.posted)
         num_postings = (ApartmentListing.query
@@ -182,16 +325,19 @@ class ShowScrapes(View):
                       .filter(post_date > since)
                       .all())
 
-        # format data into a DataFrame since it's easier to manipualte
-        # timeseries data
-        df = pd.DataFrame(postings, 
-                          columns=['post_date', 'bedrooms', 'listings'])
-        df['post_date'] = pd.to_datetime(df['post_date'])
-        df = (df.set_index(['post_date', 'bedrooms'])['listings']
-                .unstack('bedrooms')
-                .resample('1d')
-                .max()
-                .fillna(0))
-
-        return dump_json(df)
+        counts = {}
+        for post_date, bedrooms, listings in postings:
+            counts.setdefault(to_date(post_date), {})[bedrooms] = listings
+
+        # fill in days without any postings with zeros so the bars line up
+        rows = []
+        if counts:
+            day, last_day = min(counts), max(counts)
+            while day <= last_day:
+                row = {bedrooms: 0 for bedrooms in BEDROOM_TYPES}
+                row.update(counts.get(day, {}))
+                rows.append((day, row))
+                day += timedelta(1)
+        return dump_json(rows)
+
 